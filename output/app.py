@@ -1,56 +1,92 @@
-import sqlite3
 import hashlib
+import heapq
+import itertools
+import json
 import uuid
-from flask import Flask, request, jsonify, g
+from datetime import datetime, timezone
+import zlib
+from flask import Flask, request, jsonify, g, make_response, Response
 from functools import wraps
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import database
+import sharding
+from models import User
 
 app = Flask(__name__)
-app.config['DATABASE'] = 'chat_app.db'
 app.config['ADMIN_USERNAME'] = 'admin'
+app.config['EXPORT_BATCH_SIZE'] = 1000
+app.config['SHARD_COUNT'] = 4
+app.config['SHARD_PATTERN'] = 'chat_shard_{}.db'
 
 def get_db():
-    if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
-    return g.db
+    return database.SessionLocal
+
+def database_path():
+    # Caminho do chat_app.db para as ferramentas de shard, que usam sqlite3 diretamente
+    return database.engine.url.database
+
+def get_shard_paths():
+    return sharding.shard_paths(app.config['SHARD_PATTERN'], app.config['SHARD_COUNT'])
+
+def get_shard(index):
+    if 'shards' not in g:
+        g.shards = {}
+    if index not in g.shards:
+        g.shards[index] = sharding.connect(get_shard_paths()[index])
+    return g.shards[index]
 
 @app.teardown_appcontext
 def close_db(exception):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    database.SessionLocal.remove()
+    for shard in g.pop('shards', {}).values():
+        shard.close()
 
 def init_db():
+    database.init_db()
     db = get_db()
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            token TEXT,
-            is_admin INTEGER DEFAULT 0
-        )
-    """)
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER NOT NULL,
-            recipient_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(sender_id) REFERENCES users(id),
-            FOREIGN KEY(recipient_id) REFERENCES users(id)
-        )
-    """)
-    db.commit()
+    for index, path in enumerate(get_shard_paths()):
+        sharding.init_shard(path, index)
+    migrate_legacy_messages(db)
     # Create admin user if not exist
-    cur = db.execute("SELECT * FROM users WHERE username = ?", (app.config['ADMIN_USERNAME'],))
-    if cur.fetchone() is None:
-        admin_pass = hash_password('admin123')
-        db.execute("INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, 1)", 
-                   (app.config['ADMIN_USERNAME'], admin_pass))
+    if database.get_user_by_username(db, app.config['ADMIN_USERNAME']) is None:
+        db.add(User(username=app.config['ADMIN_USERNAME'], password_hash=hash_password('admin123'), is_admin=True))
+        database.bump_version(db, 'users')
         db.commit()
 
+def migrate_legacy_messages(db):
+    # Bases anteriores aos shards guardavam as mensagens em chat_app.db; move-as antes de servir
+    if not inspect(db.get_bind()).has_table('messages'):
+        return
+    db.commit()
+    # Ids que já estão em algum shard com outro conteúdo não são migrados: ficam na tabela legada com um aviso
+    collisions = sharding.conflicting_ids(get_shard_paths(), database_path())
+    moved, conflicts = sharding.rebalance(
+        [database_path()], app.config['SHARD_PATTERN'], app.config['SHARD_COUNT'], exclude=collisions
+    )
+    if conflicts:
+        app.logger.warning(
+            "%d legacy messages were left in the messages table of %s because their ids already exist in the shards: %s",
+            len(conflicts), database_path(), conflicts
+        )
+    if db.execute(text("SELECT COUNT(*) FROM messages")).scalar() == 0:
+        db.execute(text("DROP TABLE messages"))
+        db.commit()
+    if moved:
+        app.logger.info("Moved %d legacy messages to %d shards", moved, app.config['SHARD_COUNT'])
+
+def conditional_json(etag, build):
+    # Responde 304 sem executar a consulta da listagem quando o ETag do cliente ainda vale
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(build()), 200)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -63,9 +99,7 @@ def authenticate(f):
         token = request.headers.get('Authorization')
         if not token:
             return jsonify({'error': 'Auth token required'}), 401
-        db = get_db()
-        cur = db.execute("SELECT * FROM users WHERE token = ?", (token,))
-        user = cur.fetchone()
+        user = database.get_user_by_token(get_db(), token)
         if not user:
             return jsonify({'error': 'Invalid token'}), 403
         g.user = user
@@ -75,7 +109,7 @@ def authenticate(f):
 def admin_only(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        if not getattr(g, 'user', None) or g.user['is_admin'] == 0:
+        if not getattr(g, 'user', None) or not g.user.is_admin:
             return jsonify({'error': 'Admin only'}), 403
         return f(*args, **kwargs)
     return decorated
@@ -90,11 +124,15 @@ def register():
 
     db = get_db()
     try:
-        db.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
-                   (username, hash_password(password)))
+        db.add(User(username=username, password_hash=hash_password(password)))
+        database.bump_version(db, 'users')
         db.commit()
         return jsonify({'message': 'User registered successfully'}), 201
-    except sqlite3.IntegrityError:
+    except ValueError as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.rollback()
         return jsonify({'error': 'Username already exists'}), 409
 
 @app.route('/login', methods=['POST'])
@@ -106,30 +144,31 @@ def login():
         return jsonify({'error': 'username and password required'}), 400
 
     db = get_db()
-    cur = db.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cur.fetchone()
-    if user and hash_password(password) == user['password_hash']:
+    user = database.get_user_by_username(db, username)
+    if user and hash_password(password) == user.password_hash:
         token = generate_token()
-        db.execute("UPDATE users SET token = ? WHERE id = ?", (token, user['id']))
+        user.token = token
         db.commit()
-        return jsonify({'token': token, "is_admin": bool(user['is_admin']), "user_id": user['id']}), 200
+        return jsonify({'token': token, "is_admin": bool(user.is_admin), "user_id": user.id}), 200
     return jsonify({'error': 'Invalid credentials'}), 401
 
 @app.route('/logout', methods=['POST'])
 @authenticate
 def logout():
-    db = get_db()
-    db.execute("UPDATE users SET token = NULL WHERE id = ?", (g.user['id'],))
-    db.commit()
+    g.user.token = None
+    get_db().commit()
     return jsonify({'message': 'Logged out successfully'}), 200
 
 @app.route('/users', methods=['GET'])
 @authenticate
 def list_users():
     db = get_db()
-    users = db.execute("SELECT id, username, is_admin FROM users").fetchall()
-    result = [{'id': u['id'], 'username': u['username'], 'is_admin': bool(u['is_admin'])} for u in users]
-    return jsonify(result), 200
+
+    def build():
+        users = database.list_users(db)
+        return [{'id': u.id, 'username': u.username, 'is_admin': bool(u.is_admin)} for u in users]
+
+    return conditional_json(f"users-{database.get_version(db, 'users')}", build)
 
 @app.route('/messages', methods=['POST'])
 @authenticate
@@ -140,53 +179,61 @@ def send_message():
     if not recipient_id or not content:
         return jsonify({'error': 'recipient_id and content required'}), 400
     db = get_db()
-    if recipient_id == g.user['id']:
+    if recipient_id == g.user.id:
         return jsonify({"error": "Cannot send messages to yourself."}), 400
-    cur = db.execute("SELECT * FROM users WHERE id = ?", (recipient_id,))
-    if not cur.fetchone():
+    if database.get_user(db, recipient_id) is None:
         return jsonify({'error': 'Recipient not found'}), 404
-    db.execute('INSERT INTO messages (sender_id, recipient_id, content) VALUES (?, ?, ?)',
-               (g.user['id'], recipient_id, content))
-    db.commit()
+    index = sharding.shard_for(g.user.id, recipient_id, app.config['SHARD_COUNT'])
+    shard = get_shard(index)
+    sharding.insert_message(shard, index, g.user.id, recipient_id, content)
+    shard.commit()
     return jsonify({'message': 'Message sent'}), 201
 
 @app.route('/messages', methods=['GET'])
 @authenticate
 def receive_messages():
     db = get_db()
-    cur = db.execute(
-        """SELECT messages.id, users.username AS sender, messages.content, messages.timestamp
-         FROM messages
-         JOIN users ON messages.sender_id = users.id
-         WHERE messages.recipient_id = ?
-         ORDER BY messages.timestamp DESC""",
-        (g.user['id'],)
-    )
-    messages = [
+    # Mensagens só são apagadas junto com usuários, então a versão de users cobre remoções
+    # Uma consulta indexada por shard nas conexões da requisição, reaproveitadas se a resposta for 200
+    max_ids = [
+        get_shard(index).execute("SELECT MAX(id) FROM messages WHERE recipient_id = ?", (g.user.id,)).fetchone()[0]
+        for index in range(app.config['SHARD_COUNT'])
+    ]
+    max_id = '.'.join(str(value or 0) for value in max_ids)
+    etag = f"inbox-{g.user.id}-{max_id}-{database.get_version(db, 'users')}"
+    return conditional_json(etag, lambda: fetch_inbox(db, g.user.id))
+
+def fetch_inbox(db, user_id):
+    shard_rows = [
+        get_shard(index).execute(
+            "SELECT id, sender_id, content, timestamp FROM messages WHERE recipient_id = ?",
+            (user_id,)
+        ).fetchall()
+        for index in range(app.config['SHARD_COUNT'])
+    ]
+    rows = sorted(itertools.chain.from_iterable(shard_rows), key=lambda row: (row['timestamp'], row['id']), reverse=True)
+    names = database.get_usernames(db, (row['sender_id'] for row in rows))
+    return [
         {
             'id': row['id'],
-            'sender': row['sender'],
+            'sender': names[row['sender_id']],
             'content': row['content'],
             'timestamp': row['timestamp']
         }
-        for row in cur.fetchall()
+        for row in rows
+        if row['sender_id'] in names
     ]
-    return jsonify(messages), 200
 
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 @authenticate
 @admin_only
 def remove_user(user_id):
-    if user_id == g.user['id']:
+    if user_id == g.user.id:
         return jsonify({"error": "Admin cannot remove themselves."}), 400
     db = get_db()
-    cur = db.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cur.fetchone()
-    if not user:
+    if database.get_user(db, user_id) is None:
         return jsonify({'error': 'User not found'}), 404
-    db.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    db.execute("DELETE FROM messages WHERE sender_id = ? OR recipient_id = ?", (user_id, user_id))
-    db.commit()
+    database.bulk_delete_users(db, [user_id], get_shard_paths())
     return jsonify({'message': 'User removed'}), 200
 
 @app.route('/admin/messages', methods=['GET'])
@@ -194,26 +241,134 @@ def remove_user(user_id):
 @admin_only
 def admin_all_messages():
     db = get_db()
-    cur = db.execute("""
-        SELECT messages.id, s.username AS sender, r.username AS recipient, messages.content, messages.timestamp
-        FROM messages
-        JOIN users s ON messages.sender_id = s.id
-        JOIN users r ON messages.recipient_id = r.id
-        ORDER BY messages.timestamp DESC
-    """)
+    shard_rows = sharding.fan_out(get_shard_paths(), "SELECT id, sender_id, recipient_id, content, timestamp FROM messages")
+    rows = sorted(itertools.chain.from_iterable(shard_rows), key=lambda row: (row['timestamp'], row['id']), reverse=True)
+    names = database.get_usernames(db, itertools.chain.from_iterable((row['sender_id'], row['recipient_id']) for row in rows))
     messages = [
         {
             'id': row['id'],
-            'sender': row['sender'],
-            'recipient': row['recipient'],
+            'sender': names[row['sender_id']],
+            'recipient': names[row['recipient_id']],
             'content': row['content'],
             'timestamp': row['timestamp']
         }
-        for row in cur.fetchall()
+        for row in rows
+        if row['sender_id'] in names and row['recipient_id'] in names
     ]
     return jsonify(messages), 200
 
+@app.route('/admin/messages/export', methods=['GET'])
+@authenticate
+@admin_only
+def admin_export_messages():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({'error': 'format must be ndjson or json'}), 400
+    filters = []
+    params = []
+    for arg, operator in (('since', '>='), ('until', '<')):
+        if request.args.get(arg):
+            value = parse_timestamp(request.args[arg])
+            if value is None:
+                return jsonify({'error': f'{arg} must be an ISO 8601 date or datetime'}), 400
+            filters.append(f"messages.timestamp {operator} ?")
+            params.append(value)
+    if request.args.get('user_id'):
+        user_id = request.args.get('user_id', type=int)
+        if user_id is None:
+            return jsonify({'error': 'user_id must be an integer'}), 400
+        filters.append("(messages.sender_id = ? OR messages.recipient_id = ?)")
+        params.extend([user_id, user_id])
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    query = f"""
+        SELECT messages.id, messages.sender_id, messages.recipient_id, messages.content, messages.timestamp
+        FROM messages
+        {where}
+        ORDER BY messages.id
+    """
+    use_gzip = request.args.get('gzip') == '1'
+    chunks = export_rows(get_shard_paths(), query, params, fmt, app.config['EXPORT_BATCH_SIZE'])
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+    response = Response(chunks, mimetype='application/x-ndjson' if fmt == 'ndjson' else 'application/json')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    filename = f"messages.{fmt}.gz" if use_gzip else f"messages.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def parse_timestamp(value):
+    # Normaliza para o formato de CURRENT_TIMESTAMP (UTC, 'YYYY-MM-DD HH:MM:SS') para comparar como texto
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def iter_shard(path, query, params, batch_size):
+    conn = sharding.connect(path)
+    try:
+        cur = conn.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def export_rows(shard_paths, query, params, fmt, batch_size):
+    # Sessão e conexões próprias: o gerador continua rodando depois que a requisição retorna
+    session = database.SessionLocal.session_factory()
+    # Cada shard já vem ordenado por id; o merge mantém a ordem global lendo um lote por shard
+    merged = heapq.merge(*(iter_shard(path, query, params, batch_size) for path in shard_paths), key=lambda row: row['id'])
+    names = {}
+    try:
+        first = True
+        if fmt == 'json':
+            yield '['
+        while True:
+            rows = list(itertools.islice(merged, batch_size))
+            if not rows:
+                break
+            missing = {user_id for row in rows for user_id in (row['sender_id'], row['recipient_id'])} - names.keys()
+            names.update(database.get_usernames(session, missing))
+            parts = []
+            for row in rows:
+                if row['sender_id'] not in names or row['recipient_id'] not in names:
+                    continue
+                item = json.dumps({
+                    'id': row['id'],
+                    'sender': names[row['sender_id']],
+                    'recipient': names[row['recipient_id']],
+                    'content': row['content'],
+                    'timestamp': row['timestamp']
+                }, ensure_ascii=False)
+                if fmt == 'ndjson':
+                    parts.append(item + '\n')
+                else:
+                    parts.append(item if first else ',' + item)
+                first = False
+            yield ''.join(parts)
+        if fmt == 'json':
+            yield ']'
+    finally:
+        merged.close()
+        session.close()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
 if __name__ == '__main__':
     with app.app_context():
         init_db()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,36 @@
+import pytest
+
+import database
+from app import app as flask_app, init_db
+
+
+@pytest.fixture
+def app(tmp_path):
+    database.configure(f"sqlite:///{tmp_path / 'chat_app.db'}")
+    flask_app.config.update(
+        TESTING=True,
+        SHARD_COUNT=4,
+        SHARD_PATTERN=str(tmp_path / "chat_shard_{}.db"),
+    )
+    with flask_app.app_context():
+        init_db()
+    yield flask_app
+    database.SessionLocal.remove()
+    database.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    def _login(username, password="secret"):
+        if username != "admin":
+            client.post("/register", json={"username": username, "password": password})
+        else:
+            password = "admin123"
+        response = client.post("/login", json={"username": username, "password": password})
+        return response.get_json()["token"]
+    return _login
@@ -1,13 +1,34 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+import os
+from contextlib import contextmanager
 
-DATABASE_URL = "sqlite:///./app.db"
+from sqlalchemy import create_engine, event, select, update, delete
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+import sharding
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_app.db")
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+def make_engine(url):
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if url.startswith("sqlite") else {},
+        pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        pool_timeout=30,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+    )
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+engine = make_engine(DATABASE_URL)
 
 SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
@@ -20,6 +41,86 @@ def get_db():
     finally:
         db.close()
 
+def configure(url):
+    """Aponta o engine e as sessões para outro banco global (usado pelos testes)."""
+    global engine
+    SessionLocal.remove()
+    engine.dispose()
+    engine = make_engine(url)
+    SessionLocal.configure(bind=engine)
+
 def init_db():
-    import models  # Certifique-se de ter um arquivo models.py com suas models User, Message, etc.
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    # Só tabelas do banco global; as mensagens ficam nos shards (sharding.py)
+    import models
+    Base.metadata.create_all(bind=engine)
+
+@contextmanager
+def count_queries(bind=None):
+    """Conta os comandos SQL emitidos dentro do bloco, para detectar N+1 em testes."""
+    bind = bind or engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", _record)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", _record)
+
+def get_user(db, user_id):
+    from models import User
+    return db.get(User, user_id)
+
+def get_user_by_username(db, username):
+    from models import User
+    return db.execute(select(User).where(User.username == username)).scalar_one_or_none()
+
+def list_users(db):
+    from models import User
+    return db.execute(select(User).order_by(User.id)).scalars().all()
+
+def get_user_by_token(db, token):
+    from models import User
+    return db.execute(select(User).where(User.token == token)).scalar_one_or_none()
+
+def get_usernames(db, user_ids):
+    from models import User
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    rows = db.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all()
+    return {row.id: row.username for row in rows}
+
+def get_version(db, key):
+    from models import Version
+    value = db.execute(select(Version.value).where(Version.key == key)).scalar_one_or_none()
+    return value or 0
+
+def bump_version(db, key):
+    from models import Version
+    result = db.execute(update(Version).where(Version.key == key).values(value=Version.value + 1))
+    if result.rowcount == 0:
+        db.add(Version(key=key, value=1))
+
+def bulk_delete_users(db, user_ids, shard_paths):
+    from models import User
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    result = db.execute(
+        delete(User)
+        .where(User.id.in_(user_ids))
+        .execution_options(synchronize_session=False)
+    )
+    bump_version(db, 'users')
+    db.commit()
+    # Só depois da remoção confirmada: envios concorrentes que escaparem ficam para `sharding.py sweep`
+    placeholders = ','.join('?' * len(user_ids))
+    sharding.fan_out_write(
+        shard_paths,
+        f"DELETE FROM messages WHERE sender_id IN ({placeholders}) OR recipient_id IN ({placeholders})",
+        user_ids + user_ids,
+    )
+    return result.rowcount
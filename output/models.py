@@ -1,20 +1,17 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, func
-from sqlalchemy.orm import declarative_base, relationship, validates
+from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy.orm import validates
 
-Base = declarative_base()
+from database import Base
 
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
     username = Column(String(50), unique=True, nullable=False)
-    email = Column(String(120), unique=True, nullable=False)
     password_hash = Column(String(128), nullable=False)
+    token = Column(String(36))
     is_admin = Column(Boolean, default=False, nullable=False)
 
-    sent_messages = relationship('Message', back_populates='sender', foreign_keys='Message.sender_id', cascade="all, delete-orphan")
-    received_messages = relationship('Message', back_populates='receiver', foreign_keys='Message.receiver_id', cascade="all, delete-orphan")
-
     def __repr__(self):
         return f"<User(id={self.id}, username='{self.username}')>"
 
@@ -24,12 +21,6 @@ class User(Base):
             raise ValueError("Username must be at least 3 characters long.")
         return value
 
-    @validates('email')
-    def validate_email(self, key, value):
-        if not value or "@" not in value:
-            raise ValueError("Invalid email address.")
-        return value
-
     @validates('password_hash')
     def validate_password(self, key, value):
         if not value or len(value) < 8:
@@ -37,23 +28,12 @@ class User(Base):
         return value
 
 
-class Message(Base):
-    __tablename__ = 'messages'
 
-    id = Column(Integer, primary_key=True)
-    sender_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
-    receiver_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
-    content = Column(Text, nullable=False)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+class Version(Base):
+    __tablename__ = 'versions'
 
-    sender = relationship('User', back_populates='sent_messages', foreign_keys=[sender_id])
-    receiver = relationship('User', back_populates='received_messages', foreign_keys=[receiver_id])
+    key = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
 
     def __repr__(self):
-        return f"<Message(id={self.id}, sender_id={self.sender_id}, receiver_id={self.receiver_id}, timestamp={self.timestamp})>"
-
-    @validates('content')
-    def validate_content(self, key, value):
-        if not value or not value.strip():
-            raise ValueError("Message content cannot be empty.")
-        return value
\ No newline at end of file
+        return f"<Version(key='{self.key}', value={self.value})>"
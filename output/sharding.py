@@ -0,0 +1,260 @@
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Cada shard gera ids em uma faixa própria, então ids continuam únicos entre arquivos
+# e sobrevivem ao rebalanceamento. A faixa 0 fica para mensagens do banco legado.
+SHARD_ID_BITS = 40
+MAX_SHARDS = 4095  # mantém os ids abaixo de 2**53 para o cliente JavaScript
+
+_executor = ThreadPoolExecutor(max_workers=16)
+
+def shard_paths(pattern, shard_count):
+    return [pattern.format(i) for i in range(shard_count)]
+
+def shard_for(user_a, user_b, shard_count):
+    low, high = sorted((int(user_a), int(user_b)))
+    return zlib.crc32(f"{low}:{high}".encode()) % shard_count
+
+def id_range(index):
+    low = (index + 1) << SHARD_ID_BITS
+    return low, low + (1 << SHARD_ID_BITS) - 1
+
+def range_of(message_id):
+    # -1 para ids do banco legado, que não pertencem a nenhuma faixa de shard
+    return (message_id >> SHARD_ID_BITS) - 1
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def init_shard(path, index):
+    conn = connect(path)
+    # journal_mode é persistido no arquivo; basta defini-lo uma vez
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_recipient ON messages (recipient_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id)")
+    # Maior id já emitido por faixa; nunca diminui, mesmo quando o rebalanceamento tira linhas do arquivo
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_meta (
+            range_index INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        )
+    """)
+    low, high = id_range(index)
+    existing = conn.execute("SELECT MAX(id) FROM messages WHERE id BETWEEN ? AND ?", (low, high)).fetchone()[0]
+    raise_high_water(conn, index, existing or low - 1)
+    conn.commit()
+    conn.close()
+
+def raise_high_water(conn, range_index, last_id):
+    conn.execute("""
+        INSERT INTO shard_meta (range_index, last_id) VALUES (?, ?)
+        ON CONFLICT(range_index) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)
+    """, (range_index, last_id))
+
+def high_water_marks(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shard_meta'").fetchone() is None:
+        return {}
+    return {row['range_index']: row['last_id'] for row in conn.execute("SELECT range_index, last_id FROM shard_meta")}
+
+def insert_message(conn, index, sender_id, recipient_id, content):
+    # O UPDATE abre a transação de escrita, então a reserva do id e o INSERT são atômicos
+    conn.execute("UPDATE shard_meta SET last_id = last_id + 1 WHERE range_index = ?", (index,))
+    message_id = conn.execute("SELECT last_id FROM shard_meta WHERE range_index = ?", (index,)).fetchone()[0]
+    conn.execute("""
+        INSERT INTO messages (id, sender_id, recipient_id, content)
+        VALUES (?, ?, ?, ?)
+    """, (message_id, sender_id, recipient_id, content))
+    return message_id
+
+def _query(path, query, params):
+    conn = connect(path)
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+def _execute(path, statement, params):
+    conn = connect(path)
+    try:
+        cur = conn.execute(statement, params)
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def fan_out(paths, query, params=()):
+    """Executa a consulta em todos os shards em paralelo e devolve uma lista de linhas por shard."""
+    return list(_executor.map(lambda path: _query(path, query, params), paths))
+
+def fan_out_write(paths, statement, params=()):
+    return sum(_executor.map(lambda path: _execute(path, statement, params), paths))
+
+def sweep_orphans(paths, database):
+    """Apaga mensagens cujo remetente ou destinatário não existe mais no banco global."""
+    removed = 0
+    for path in paths:
+        conn = connect(path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS global_db", (database,))
+            cur = conn.execute("""
+                DELETE FROM messages
+                WHERE sender_id NOT IN (SELECT id FROM global_db.users)
+                   OR recipient_id NOT IN (SELECT id FROM global_db.users)
+            """)
+            conn.commit()
+            removed += cur.rowcount
+        finally:
+            conn.close()
+    return removed
+
+def conflicting_ids(paths, database):
+    """Ids da tabela messages de `database` que já existem em algum shard com outro conteúdo."""
+    found = set()
+    for path in paths:
+        conn = connect(path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS source_db", (database,))
+            found.update(row[0] for row in conn.execute(
+                """
+                SELECT messages.id FROM messages JOIN source_db.messages AS source USING (id)
+                WHERE messages.sender_id IS NOT source.sender_id
+                   OR messages.recipient_id IS NOT source.recipient_id
+                   OR messages.content IS NOT source.content
+                   OR messages.timestamp IS NOT source.timestamp
+                """
+            ))
+        finally:
+            conn.close()
+    return found
+
+def rebalance(sources, pattern, shard_count, batch_size=1000, exclude=()):
+    """Move cada mensagem das bases de origem para o shard da sua conversa.
+
+    As origens podem ser os shards de uma configuração anterior ou o banco legado
+    com a tabela messages. Os ids são preservados, e uma linha só é apagada da origem
+    depois de confirmada no destino, então o processo pode ser repetido após uma falha.
+    Linhas cujo id já existe no destino com outro conteúdo ficam na origem e são
+    devolvidas como conflitos, assim como os ids em `exclude`. Retorna (movidas, ids em conflito).
+    """
+    if not 0 < shard_count <= MAX_SHARDS:
+        raise ValueError(f"shard_count must be between 1 and {MAX_SHARDS}")
+    targets = shard_paths(pattern, shard_count)
+    for i, path in enumerate(targets):
+        init_shard(path, i)
+    target_index = {os.path.abspath(path): i for i, path in enumerate(targets)}
+    marks = {}
+    moved = 0
+    conflicts = []
+    for source in sources:
+        source_index = target_index.get(os.path.abspath(source))
+        conn = connect(source)
+        for range_index, last_id in high_water_marks(conn).items():
+            marks[range_index] = max(marks.get(range_index, last_id), last_id)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone() is None:
+            conn.close()
+            continue
+        last_id = -1
+        while True:
+            rows = conn.execute("""
+                SELECT id, sender_id, recipient_id, content, timestamp FROM messages
+                WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            batches = {}
+            for row in rows:
+                if row['id'] in exclude:
+                    conflicts.append(row['id'])
+                    continue
+                index = shard_for(row['sender_id'], row['recipient_id'], shard_count)
+                if index != source_index:
+                    batches.setdefault(index, []).append(tuple(row))
+            for index, batch in batches.items():
+                target = connect(targets[index])
+                landed = []
+                for row in batch:
+                    cur = target.execute("""
+                        INSERT OR IGNORE INTO messages (id, sender_id, recipient_id, content, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, row)
+                    if cur.rowcount == 1:
+                        landed.append(row)
+                        continue
+                    existing = target.execute("""
+                        SELECT id, sender_id, recipient_id, content, timestamp FROM messages WHERE id = ?
+                    """, (row[0],)).fetchone()
+                    if tuple(existing) == row:
+                        # já copiada por uma execução interrompida; só falta apagar da origem
+                        landed.append(row)
+                    else:
+                        conflicts.append(row[0])
+                for row in landed:
+                    if range_of(row[0]) >= 0:
+                        raise_high_water(target, range_of(row[0]), row[0])
+                target.commit()
+                target.close()
+                conn.executemany("DELETE FROM messages WHERE id = ?", [(row[0],) for row in landed])
+                conn.commit()
+                moved += len(landed)
+        conn.close()
+    # Propaga as marcas para todos os destinos: um arquivo recriado não reemite ids de sua faixa
+    for path in targets:
+        target = connect(path)
+        for range_index, last_id in marks.items():
+            raise_high_water(target, range_index, last_id)
+        target.commit()
+        target.close()
+    return moved, conflicts
+
+def main():
+    parser = argparse.ArgumentParser(description="Ferramenta offline de shards de mensagens")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebalance_parser = subparsers.add_parser("rebalance", help="redistribui mensagens para um novo número de shards")
+    rebalance_parser.add_argument("--shards", type=int, required=True)
+    rebalance_parser.add_argument("--pattern", default="chat_shard_{}.db")
+    rebalance_parser.add_argument("--batch-size", type=int, default=1000)
+    rebalance_parser.add_argument("--database", default="chat_app.db", help="banco global, incluído nas origens padrão")
+    rebalance_parser.add_argument("sources", nargs="*", help="bases de origem (padrão: shards existentes e o banco global)")
+    sweep_parser = subparsers.add_parser("sweep", help="remove mensagens de usuários que não existem mais")
+    sweep_parser.add_argument("--pattern", default="chat_shard_{}.db")
+    sweep_parser.add_argument("--database", default="chat_app.db")
+    args = parser.parse_args()
+
+    if args.command == "sweep":
+        removed = sweep_orphans(sorted(glob.glob(args.pattern.format("*"))), args.database)
+        print(f"{removed} mensagens órfãs removidas")
+        return
+
+    sources = args.sources or sorted(glob.glob(args.pattern.format("*")))
+    if not args.sources and os.path.exists(args.database):
+        sources.append(args.database)
+    moved, conflicts = rebalance(sources, args.pattern, args.shards, args.batch_size)
+    print(f"{moved} mensagens movidas para {args.shards} shards")
+    if conflicts:
+        print(f"{len(conflicts)} mensagens com id em conflito ficaram na origem:", ", ".join(map(str, conflicts)))
+    leftovers = [path for path in sources if path not in shard_paths(args.pattern, args.shards) and path != args.database]
+    if leftovers and not conflicts:
+        print("Bases de origem fora da nova configuração (já esvaziadas):", ", ".join(leftovers))
+    if conflicts:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import gzip
+import json
+
+import sharding
+from app import parse_timestamp
+
+
+def test_users_matching_etag_returns_304(client, login):
+    token = login("admin")
+    first = client.get("/users", headers={"Authorization": token})
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+
+    for candidate in (etag, f"W/{etag}"):
+        response = client.get("/users", headers={"Authorization": token, "If-None-Match": candidate})
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == etag
+
+
+def test_users_etag_changes_after_register_and_remove(client, login):
+    token = login("admin")
+    before = client.get("/users", headers={"Authorization": token}).headers["ETag"]
+    client.post("/register", json={"username": "carol", "password": "secret"})
+    after_register = client.get("/users", headers={"Authorization": token})
+    assert after_register.headers["ETag"] != before
+    carol = next(u for u in after_register.get_json() if u["username"] == "carol")
+
+    assert client.delete(f"/users/{carol['id']}", headers={"Authorization": token}).status_code == 200
+    response = client.get("/users", headers={"Authorization": token, "If-None-Match": after_register.headers["ETag"]})
+    assert response.status_code == 200
+    assert "carol" not in [u["username"] for u in response.get_json()]
+
+
+def test_inbox_etag_changes_after_send(client, login):
+    admin = login("admin")
+    bob = login("bob")
+    inbox = client.get("/messages", headers={"Authorization": bob})
+    etag = inbox.headers["ETag"]
+    assert client.get("/messages", headers={"Authorization": bob, "If-None-Match": etag}).status_code == 304
+
+    client.post("/messages", json={"recipient_id": 2, "content": "oi"}, headers={"Authorization": admin})
+    response = client.get("/messages", headers={"Authorization": bob, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [m["content"] for m in response.get_json()] == ["oi"]
+
+
+def add_message(app, sender_id, recipient_id, content, timestamp=None):
+    index = sharding.shard_for(sender_id, recipient_id, app.config["SHARD_COUNT"])
+    conn = sharding.connect(app.config["SHARD_PATTERN"].format(index))
+    message_id = sharding.insert_message(conn, index, sender_id, recipient_id, content)
+    if timestamp:
+        conn.execute("UPDATE messages SET timestamp = ? WHERE id = ?", (timestamp, message_id))
+    conn.commit()
+    conn.close()
+    return message_id
+
+
+def export(client, token, query=""):
+    return client.get(f"/admin/messages/export{query}", headers={"Authorization": token})
+
+
+def test_export_ndjson(app, client, login):
+    admin = login("admin")
+    login("bob")
+    ids = [add_message(app, 1, 2, f"m{i}") for i in range(3)]
+    response = export(client, admin)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["Content-Disposition"] == "attachment; filename=messages.ndjson"
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row["id"] for row in rows] == sorted(ids)
+    assert rows[0] == {"id": ids[0], "sender": "admin", "recipient": "bob", "content": "m0", "timestamp": rows[0]["timestamp"]}
+
+
+def test_export_json_array_skips_leading_orphans(app, client, login):
+    admin = login("admin")
+    login("bob")
+    app.config["EXPORT_BATCH_SIZE"] = 2
+    try:
+        # remetentes inexistentes no mesmo shard, com ids menores: o primeiro lote começa descartando linhas
+        assert sharding.shard_for(98, 99, 4) == sharding.shard_for(1, 2, 4)
+        for i in range(3):
+            add_message(app, 98, 99, f"orphan{i}")
+        add_message(app, 1, 2, "ok")
+        response = export(client, admin, "?format=json")
+    finally:
+        app.config["EXPORT_BATCH_SIZE"] = 1000
+    assert response.mimetype == "application/json"
+    assert [row["content"] for row in json.loads(response.data)] == ["ok"]
+
+
+def test_export_gzip_round_trip(app, client, login):
+    admin = login("admin")
+    login("bob")
+    add_message(app, 1, 2, "comprimido")
+    response = export(client, admin, "?format=json&gzip=1")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Disposition"] == "attachment; filename=messages.json.gz"
+    assert [row["content"] for row in json.loads(gzip.decompress(response.data))] == ["comprimido"]
+
+
+def test_parse_timestamp_normalises_iso_input():
+    assert parse_timestamp("2026-10-19") == "2026-10-19 00:00:00"
+    assert parse_timestamp("2026-10-19T08:30:00") == "2026-10-19 08:30:00"
+    assert parse_timestamp("2026-10-19T08:30:00Z") == "2026-10-19 08:30:00"
+    assert parse_timestamp("2026-10-19T05:30:00-03:00") == "2026-10-19 08:30:00"
+    assert parse_timestamp("ontem") is None
+
+
+def test_export_date_filters(app, client, login):
+    admin = login("admin")
+    login("bob")
+    add_message(app, 1, 2, "antes", "2026-10-18 23:59:59")
+    add_message(app, 1, 2, "manha", "2026-10-19 08:00:00")
+    add_message(app, 1, 2, "depois", "2026-10-20 00:00:00")
+
+    def contents(query):
+        return [json.loads(line)["content"] for line in export(client, admin, query).data.decode().splitlines()]
+
+    assert contents("?since=2026-10-19&until=2026-10-20") == ["manha"]
+    assert contents("?since=2026-10-19T00:00:00Z&until=2026-10-20T00:00:00Z") == ["manha"]
+    assert contents("?since=2026-10-19T00:00:00") == ["manha", "depois"]
+
+
+def test_export_rejects_bad_arguments(client, login):
+    admin = login("admin")
+    for query in ("?format=csv", "?user_id=abc", "?since=ontem", "?until=2026-13-01"):
+        assert export(client, admin, query).status_code == 400
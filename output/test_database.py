@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+import sharding
+from database import Base, count_queries
+from models import User
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    session.add_all([User(username=f"user{i}", password_hash="x" * 64) for i in range(1, 6)])
+    session.commit()
+    session.expunge_all()
+    yield session
+    session.close()
+
+
+def test_global_schema_has_no_messages_table(engine):
+    assert "messages" not in Base.metadata.tables
+    assert not engine.dialect.has_table(engine.connect(), "messages")
+
+
+def test_list_users_query_count(db, engine):
+    with count_queries(engine) as statements:
+        users = database.list_users(db)
+        names = [u.username for u in users]
+    assert names == [f"user{i}" for i in range(1, 6)]
+    assert len(statements) == 1
+
+
+def test_get_user_by_username_query_count(db, engine):
+    with count_queries(engine) as statements:
+        user = database.get_user_by_username(db, "user3")
+    assert user.id == 3
+    assert len(statements) == 1
+
+
+def test_bump_version_creates_and_increments(db):
+    assert database.get_version(db, "users") == 0
+    database.bump_version(db, "users")
+    db.commit()
+    database.bump_version(db, "users")
+    db.commit()
+    assert database.get_version(db, "users") == 2
+
+
+def test_bulk_delete_users_bumps_version_and_purges_shards(db, tmp_path):
+    paths = [str(tmp_path / f"shard_{i}.db") for i in range(2)]
+    for index, path in enumerate(paths):
+        sharding.init_shard(path, index)
+    for sender, recipient in [(1, 2), (2, 3), (3, 4), (4, 5)]:
+        index = sharding.shard_for(sender, recipient, len(paths))
+        conn = sharding.connect(paths[index])
+        sharding.insert_message(conn, index, sender, recipient, "oi")
+        conn.commit()
+        conn.close()
+
+    assert database.bulk_delete_users(db, [1, 2], paths) == 2
+    assert database.get_version(db, "users") == 1
+    assert [u.id for u in database.list_users(db)] == [3, 4, 5]
+    remaining = [tuple(row) for rows in sharding.fan_out(paths, "SELECT sender_id, recipient_id FROM messages") for row in rows]
+    assert sorted(remaining) == [(3, 4), (4, 5)]
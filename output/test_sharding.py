@@ -0,0 +1,170 @@
+import sqlite3
+
+import pytest
+
+import database
+import sharding
+from app import migrate_legacy_messages, get_shard_paths
+
+
+@pytest.fixture
+def pattern(tmp_path):
+    return str(tmp_path / "shard_{}.db")
+
+
+def init(pattern, count):
+    paths = sharding.shard_paths(pattern, count)
+    for index, path in enumerate(paths):
+        sharding.init_shard(path, index)
+    return paths
+
+
+def send(pattern, count, sender_id, recipient_id, content):
+    index = sharding.shard_for(sender_id, recipient_id, count)
+    conn = sharding.connect(pattern.format(index))
+    message_id = sharding.insert_message(conn, index, sender_id, recipient_id, content)
+    conn.commit()
+    conn.close()
+    return message_id
+
+
+def all_rows(paths):
+    return sorted(
+        tuple(row)
+        for rows in sharding.fan_out(paths, "SELECT id, sender_id, recipient_id, content FROM messages")
+        for row in rows
+    )
+
+
+def test_shard_for_is_symmetric():
+    for count in (1, 2, 4, 7):
+        for a in range(1, 20):
+            for b in range(1, 20):
+                assert sharding.shard_for(a, b, count) == sharding.shard_for(b, a, count)
+
+
+def test_ids_not_reused_after_rebalance_moves_top_of_range(pattern):
+    init(pattern, 2)
+    stays = next((1, b) for b in range(2, 100)
+                 if sharding.shard_for(1, b, 2) == 0 and sharding.shard_for(1, b, 4) == 0)
+    leaves = next((1, b) for b in range(2, 100)
+                  if sharding.shard_for(1, b, 2) == 0 and sharding.shard_for(1, b, 4) != 0)
+    send(pattern, 2, *stays, "a")
+    top = send(pattern, 2, *leaves, "b")
+
+    assert sharding.rebalance(sharding.shard_paths(pattern, 2), pattern, 4) == (1, [])
+    reissued = send(pattern, 4, *stays, "c")
+    assert reissued > top
+
+    moved, conflicts = sharding.rebalance(sharding.shard_paths(pattern, 4), pattern, 2)
+    assert conflicts == []
+    rows = all_rows(sharding.shard_paths(pattern, 4))
+    assert [row[3] for row in rows] == ["a", "b", "c"]
+    assert len({row[0] for row in rows}) == 3
+
+
+def test_rebalance_resumes_after_partial_copy(pattern):
+    paths = init(pattern, 1)
+    for b in range(2, 12):
+        send(pattern, 1, 1, b, f"m{b}")
+    before = all_rows(paths)
+
+    # simula uma execução interrompida: a linha já foi copiada para o destino mas não apagada da origem
+    new_paths = init(pattern, 3)
+    row = next(r for r in before if sharding.shard_for(r[1], r[2], 3) != 0)
+    target = sharding.connect(new_paths[sharding.shard_for(row[1], row[2], 3)])
+    source = sharding.connect(paths[0])
+    source_row = source.execute(
+        "SELECT id, sender_id, recipient_id, content, timestamp FROM messages WHERE id = ?", (row[0],)
+    ).fetchone()
+    source.close()
+    target.execute("INSERT INTO messages (id, sender_id, recipient_id, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                   tuple(source_row))
+    target.commit()
+    target.close()
+
+    assert sharding.rebalance(new_paths, pattern, 3)[1] == []
+    assert all_rows(new_paths) == before
+    assert sharding.rebalance(new_paths, pattern, 3) == (0, [])
+    assert all_rows(new_paths) == before
+
+
+def test_conflicting_id_stays_in_source_and_is_reported(pattern):
+    paths = init(pattern, 2)
+    pair = next((1, b) for b in range(2, 100) if sharding.shard_for(1, b, 2) == 1)
+    source = sharding.connect(paths[0])
+    source.execute("INSERT INTO messages (id, sender_id, recipient_id, content) VALUES (5, ?, ?, 'x')", pair)
+    source.commit()
+    target = sharding.connect(paths[1])
+    target.execute("INSERT INTO messages (id, sender_id, recipient_id, content) VALUES (5, 7, 8, 'y')")
+    target.commit()
+    target.close()
+
+    assert sharding.rebalance([paths[0]], pattern, 2) == (0, [5])
+    assert source.execute("SELECT content FROM messages WHERE id = 5").fetchone()[0] == "x"
+    source.close()
+
+
+def test_sweep_orphans_removes_messages_of_missing_users(pattern, tmp_path):
+    global_db = str(tmp_path / "global.db")
+    conn = sqlite3.connect(global_db)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO users (id) VALUES (?)", [(1,), (2,)])
+    conn.commit()
+    conn.close()
+    paths = init(pattern, 2)
+    send(pattern, 2, 1, 2, "ok")
+    send(pattern, 2, 1, 3, "orphan")
+
+    assert sharding.sweep_orphans(paths, global_db) == 1
+    assert [row[3] for row in all_rows(paths)] == ["ok"]
+
+
+def create_legacy_messages(rows):
+    conn = sqlite3.connect(database.engine.url.database)
+    conn.execute("""
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.executemany("INSERT INTO messages (id, sender_id, recipient_id, content) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def legacy_table_exists():
+    conn = sqlite3.connect(database.engine.url.database)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages'").fetchone() is not None
+    finally:
+        conn.close()
+
+
+def test_migrate_legacy_messages_imports_table(app):
+    create_legacy_messages([(1, 1, 2, "legado1"), (2, 2, 1, "legado2")])
+    with app.app_context():
+        migrate_legacy_messages(database.SessionLocal)
+        rows = all_rows(get_shard_paths())
+    assert rows == [(1, 1, 2, "legado1"), (2, 2, 1, "legado2")]
+    assert not legacy_table_exists()
+
+
+def test_migrate_legacy_messages_keeps_colliding_ids(app, caplog):
+    with app.app_context():
+        paths = get_shard_paths()
+        index = sharding.shard_for(1, 2, len(paths))
+        conn = sharding.connect(paths[index])
+        conn.execute("INSERT INTO messages (id, sender_id, recipient_id, content) VALUES (1, 1, 2, 'migrada')")
+        conn.commit()
+        conn.close()
+        create_legacy_messages([(1, 1, 2, "reusada"), (2, 2, 1, "nova")])
+
+        migrate_legacy_messages(database.SessionLocal)
+        rows = all_rows(paths)
+    assert rows == [(1, 1, 2, "migrada"), (2, 2, 1, "nova")]
+    assert legacy_table_exists()
+    assert "already exist in the shards" in caplog.text
@@ -1,23 +1,15 @@
 import os
+import re
 import json
 from openai import OpenAI
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def load_requirements(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
-def remove_fences(text: str) -> str:
-    return "\n".join(
-        line for line in text.splitlines()
-        if not line.strip().startswith("```")
-    )
+MODEL = "gpt-4.1"
+# arquivos "small" do plano são agrupados em uma única requisição; 1 desativa o agrupamento
+MAX_FILES_PER_REQUEST = int(os.getenv("MAX_FILES_PER_REQUEST", "4"))
 
-
-def generate_code_tasks(requirements):
-    """Pede ao modelo para decompor o projeto em arquivos de código."""
-    prompt = f"""
+GLOBAL_RULES = """
 Você é um engenheiro de software sênior. Considere as seguintes necessidades:
 
 - não escreva comentários no código
@@ -29,31 +21,72 @@ Você é um engenheiro de software sênior. Considere as seguintes necessidades:
 - Gere apenas código válido e executável na versão atual das dependências.
 - lembre de fazer o index.js, main.jsx e index.html na pasta src para frontends em node.js
 - Se usar node.js, gere o código vite e configure de acordo
+"""
 
+FILE_START = "=== FILE: {} ==="
+FILE_END = "=== END FILE ==="
+
+def load_requirements(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def remove_fences(text: str) -> str:
+    return "\n".join(
+        line for line in text.splitlines()
+        if not line.strip().startswith("```")
+    )
+
+
+def split_files(text):
+    """Separa uma resposta com vários arquivos delimitados em {filename: código}."""
+    pattern = re.compile(
+        r"^=== FILE: (.+?) ===[ \t]*\n(.*?)^=== END FILE ===[ \t]*$",
+        re.DOTALL | re.MULTILINE,
+    )
+    return {name.strip(): code for name, code in pattern.findall(text)}
 
-Com base nos requisitos abaixo, divida o sistema em uma lista de arquivos 
+
+def base_messages(requirements):
+    # Mesmo início em todas as requisições, para reaproveitar o cache de prefixo do provedor
+    return [
+        {"role": "system", "content": GLOBAL_RULES},
+        {"role": "user", "content": f"Requisitos do projeto:\n{requirements}"},
+    ]
+
+
+def shared_prefix(requirements, tasks):
+    """Prefixo estável: regras globais, requisitos e o plano de arquivos do projeto."""
+    plan = json.dumps(tasks, ensure_ascii=False, indent=2)
+    return base_messages(requirements) + [
+        {"role": "user", "content": f"Plano de arquivos do projeto:\n{plan}"},
+    ]
+
+
+def generate_code_tasks(requirements):
+    """Pede ao modelo para decompor o projeto em arquivos de código."""
+    prompt = """
+Com base nos requisitos acima, divida o sistema em uma lista de arquivos 
 de código a serem implementados. Para cada arquivo descreva:
 
 - nome do arquivo
 - propósito
 - tecnologias usadas
 - responsabilidades
-
-Requisitos:
-{requirements}
+- tamanho estimado: "small" (até ~80 linhas), "medium" ou "large"
 
 Responda SOMENTE em JSON no formato:
 [
-  {{
+  {
     "filename": "...",
-    "description": "..."
-  }}
+    "description": "...",
+    "size": "small"
+  }
 ]
 """
 
     resp = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[{"role": "user", "content": prompt}],
+        model=MODEL,
+        messages=base_messages(requirements) + [{"role": "user", "content": prompt}],
         # se quiser, pode tirar o response_format, não é obrigatório
         # response_format={"type": "json_object"}
     )
@@ -64,26 +97,63 @@ Responda SOMENTE em JSON no formato:
     return tasks
 
 
-def generate_code_file(requirements, file_spec):
+def generate_code_file(prefix, file_spec):
     """Gera um arquivo de código individualmente."""
     prompt = f"""
 Gere o conteúdo completo para o arquivo: {file_spec["filename"]}
 
-Descrição do arquivo:
-{file_spec["description"]}
+Regras:
+- Produza apenas código.
+- Não explique nada.
+"""
+    resp = client.chat.completions.create(
+        model=MODEL,
+        messages=prefix + [{"role": "user", "content": prompt}]
+    )
+    return resp.choices[0].message.content
+
 
-Requisitos gerais do projeto:
-{requirements}
+def generate_code_batch(prefix, file_specs):
+    """Gera vários arquivos pequenos em uma única requisição."""
+    filenames = "\n".join(f"- {spec['filename']}" for spec in file_specs)
+    prompt = f"""
+Gere o conteúdo completo para os arquivos:
+{filenames}
 
 Regras:
 - Produza apenas código.
 - Não explique nada.
+- Delimite cada arquivo exatamente assim, sem blocos de código markdown:
+{FILE_START.format("<nome do arquivo>")}
+<conteúdo>
+{FILE_END}
 """
     resp = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[{"role": "user", "content": prompt}]
+        model=MODEL,
+        messages=prefix + [{"role": "user", "content": prompt}]
     )
-    return resp.choices[0].message.content
+    return split_files(resp.choices[0].message.content)
+
+
+def plan_requests(tasks, max_files):
+    """Agrupa os arquivos pequenos em lotes; os demais seguem um por requisição."""
+    if max_files <= 1:
+        return [[spec] for spec in tasks]
+    small = [spec for spec in tasks if spec.get("size") == "small"]
+    others = [spec for spec in tasks if spec.get("size") != "small"]
+    batches = [small[i:i + max_files] for i in range(0, len(small), max_files)]
+    return [[spec] for spec in others] + batches
+
+
+def write_file(filename, code):
+    path = os.path.join("output", filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    code = remove_fences(code)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(code)
+
+    print(f"✔️ Criado: {filename}")
 
 
 def main():
@@ -93,18 +163,21 @@ def main():
     tasks = generate_code_tasks(requirements)
 
     os.makedirs("output", exist_ok=True)
+    prefix = shared_prefix(requirements, tasks)
 
     print("🧱 Gerando arquivos...")
-    for spec in tasks:
-        code = generate_code_file(requirements, spec)
-        path = os.path.join("output", spec["filename"])
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-
-        code = remove_fences(code)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(code)
-
-        print(f"✔️ Criado: {spec['filename']}")
+    for group in plan_requests(tasks, MAX_FILES_PER_REQUEST):
+        if len(group) == 1:
+            write_file(group[0]["filename"], generate_code_file(prefix, group[0]))
+            continue
+
+        files = generate_code_batch(prefix, group)
+        for spec in group:
+            code = files.get(spec["filename"])
+            if code is None:
+                # resposta em lote incompleta: gera o arquivo faltante sozinho
+                code = generate_code_file(prefix, spec)
+            write_file(spec["filename"], code)
 
     print("🏁 Finalizado. Arquivos em /output")
 